@@ -7,15 +7,24 @@ Vision Transformer模型进行情感分类。主要功能包括：
 3. 返回情感分类结果和置信度
 """
 
-import base64
-import io
-import json
+import asyncio
+import concurrent.futures
+import glob
+import numba
+import numpy as np
+import orjson
+import os
+import platform
+import pybase64
 import torch
-from PIL import Image
+from collections import OrderedDict
+from torch import nn
+from torchvision import transforms as T
+from torchvision.io import ImageReadMode, decode_image
 from fastapi import FastAPI, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.websockets import WebSocketDisconnect
-from transformers import AutoFeatureExtractor, AutoModelForImageClassification
+from transformers import AutoImageProcessor, AutoModelForImageClassification
 
 # 初始化FastAPI应用实例
 app = FastAPI()
@@ -30,12 +39,508 @@ app.add_middleware(
     allow_headers=["*"],  # 允许所有HTTP头
 )
 
+# 模型路径及推理后端配置
+# 推理后端可通过环境变量EMOTION_BACKEND选择：
+#   torchscript - INT8动态量化 + TorchScript冻结（默认）
+#   onnx        - 导出为ONNX并使用ONNX Runtime推理
+#   inductor    - 使用torch.compile（Inductor）编译
+# EMOTION_MODEL_DIR可指向离线剪枝并重新校准后的模型目录；
+# EMOTION_VIT_DEPTH设置后，加载时只保留前N个Transformer编码层（未设置时不剪枝）
+MODEL_DIR = os.environ.get("EMOTION_MODEL_DIR", "./vit-face-expression")
+VIT_DEPTH = os.environ.get("EMOTION_VIT_DEPTH")  # 原始字符串，在startup_event中校验
+INFER_BACKEND = os.environ.get("EMOTION_BACKEND", "torchscript")
+# EMOTION_RESULT_CACHE=1时启用推理结果缓存（默认关闭，与模型输出的一致性尚未充分评估）
+RESULT_CACHE_ENABLED = os.environ.get("EMOTION_RESULT_CACHE") == "1"
+
 # 全局模型和处理器变量
 # 使用None初始化，在应用启动时加载，避免在导入模块时阻塞
 # 这种方式可以提高应用的启动速度和错误处理能力
 extractor = None  # 特征提取器：用于图像预处理
 model = None     # 分类模型：用于情感识别
-id2label = None  # 标签映射：用于将预测索引转换为情感标签
+id2label = None  # 标签映射：按预测索引排列的情感标签元组
+payload_prefixes = None  # 按预测索引预先序列化的结果JSON前缀，只需在末尾拼接置信度
+transform = None  # 预处理流水线：启动时根据特征提取器的配置构建一次
+input_size = None  # 模型输入尺寸 (height, width)
+norm_scale = None  # 归一化缩放系数 1 / (255 * std)，形状为(3,)
+norm_shift = None  # 归一化偏移量 -mean / std，形状为(3,)
+# 计算设备：TorchScript后端在CUDA可用时使用GPU并以FP16推理，否则使用CPU
+device = torch.device("cpu")
+
+# 微批处理相关配置和状态
+# 多个客户端同时发送的帧会在一个很短的时间窗口内合并为一个批次进行推理，
+# 批次大小设置上限以控制尾延迟
+MAX_BATCH_SIZE = 16     # 单个批次的最大帧数
+BATCH_WINDOW = 0.005    # 收到第一帧后等待其他帧加入的时间（秒）
+pending = None          # 待推理队列，元素为 (pixel_values, future)
+batch_task = None       # 后台批处理任务，保存引用以防被垃圾回收
+infer_executor = None   # 专用推理线程，模型前向传播在其中执行，不阻塞事件循环
+batch_buffer = None     # 使用GPU时预分配的锁页内存批次缓冲区，支持异步拷贝到显存
+# Inductor后端按固定的批次大小分桶，批次补齐到不小于实际帧数的最小桶，
+# 只需为这几种大小编译，且全部可在启动时预热
+COMPILE_BATCH_SIZES = (1, 2, 4, 8, MAX_BATCH_SIZE)
+
+# 推理结果缓存（每个连接独立，使用OrderedDict实现LRU淘汰策略）
+# 视频中连续帧的人脸几乎相同，以64位平均哈希为键缓存 (pred, conf)，命中时跳过整个前向传播。
+# 摄像头噪声会使相邻帧的哈希有个别位不同，汉明距离不超过阈值即视为同一画面。
+# 平均哈希较粗糙，表情的细微变化可能映射到同一个键，因此每个条目连续命中一定次数后
+# 强制重新推理，以刷新结果
+RESULT_CACHE_SIZE = 64   # 每个连接缓存的最大条目数
+HASH_MAX_DISTANCE = 1    # 视为近似重复帧的最大汉明距离（位）
+CACHE_MAX_HITS = 5       # 单个条目被连续复用的最大次数
+
+_interop_configured = False  # inter-op线程数是否已在本进程中设置过
+
+
+class ViTClassifier(nn.Module):
+    """对HuggingFace分类模型的轻量包装，便于TorchScript追踪
+
+    HF模型的输出是ModelOutput对象，且forward接受关键字参数，直接追踪并不友好。
+    该包装只接收pixel_values张量，并直接返回logits张量。
+    softmax单调，argmax可直接在logits上计算，因此不在图中做softmax。
+    """
+
+    def __init__(self, m):
+        super().__init__()
+        self.m = m
+
+    def forward(self, pixel_values):
+        return self.m(pixel_values).logits
+
+
+def configure_torch():
+    """配置PyTorch的线程数和矩阵乘法精度
+
+    intra-op线程数设置为物理核心数（按超线程折半估算），inter-op线程数设为1，
+    使单次前向传播的并行度稳定可预期。同时允许在支持的硬件上使用
+    TF32等降低精度的GEMM路径。
+
+    注意：intra-op线程数是进程级设置，每个调用torch算子的线程都会建立各自的
+    OpenMP线程组。事件循环线程上的torchvision缩放（仅JPEG/PNG帧需要，前端默认
+    发送的原始RGB帧不经过缩放）与推理线程并发时，实际线程数会超过该设置。
+    """
+    global _interop_configured
+    torch.set_num_threads(max(1, (os.cpu_count() or 2) // 2))
+    # set_num_interop_threads在同一进程中只能成功调用一次（且须在inter-op并行开始前），
+    # 再次启动应用（如复用的TestClient）时跳过，避免整个启动流程失败
+    if not _interop_configured:
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError as e:
+            print("⚠️ Could not set inter-op threads:", e)
+        _interop_configured = True
+    torch.set_float32_matmul_precision("high")
+
+
+def get_input_size(extractor):
+    """从特征提取器的配置中读取模型输入尺寸 (height, width)
+
+    不同版本的transformers中size可能是整数、包含height/width或shortest_edge的字典，
+    快速图像处理器中还可能是SizeDict对象，这里统一转换为二元组。
+    """
+    size = extractor.size
+    if isinstance(size, int):
+        return size, size
+    get = size.get if isinstance(size, dict) else (lambda key: getattr(size, key, None))
+    if get("height") and get("width"):
+        return get("height"), get("width")
+    return get("shortest_edge"), get("shortest_edge")
+
+
+def build_transform(extractor):
+    """根据特征提取器的配置构建torchvision预处理流水线
+
+    与extractor的输出一致，但只在启动时构建一次，
+    避免每帧都经过HF预处理中的字典构造和numpy往返。
+    流水线直接作用于解码得到的uint8 CHW张量，全程不经过PIL。
+    这里只负责缩放，归一化由preprocess在预分配的张量上原地完成。
+    """
+    size = get_input_size(extractor)
+    return T.Compose([
+        T.Resize(size, interpolation=T.InterpolationMode.BILINEAR, antialias=True),
+        T.CenterCrop(size),
+    ])
+
+
+def build_normalization(extractor):
+    """根据特征提取器的配置构建归一化参数
+
+    (x / 255 - mean) / std 等价于 x * scale + shift，
+    其中 scale = 1 / (255 * std)，shift = -mean / std，每个像素只需一次乘加。
+    """
+    mean = np.asarray(extractor.image_mean, dtype=np.float32)
+    std = np.asarray(extractor.image_std, dtype=np.float32)
+    return 1.0 / (255.0 * std), -mean / std
+
+
+@numba.njit(fastmath=True, cache=True)
+def normalize_into(src, out, scale, shift):
+    """将uint8 CHW图像归一化为float32，单次遍历直接写入out
+
+    out可以是任意步长的CHW视图（如channels_last张量的numpy视图），
+    最内层按通道循环，与channels_last的内存顺序一致，便于向量化。
+    该内核在事件循环线程上单线程执行：224x224的数据量下多线程唤醒的开销
+    与计算本身相当，且会与推理线程争抢核心。
+    """
+    channels, height, width = src.shape
+    for y in range(height):
+        for x in range(width):
+            for c in range(channels):
+                out[c, y, x] = src[c, y, x] * scale[c] + shift[c]
+
+
+def alloc_pixel_values():
+    """分配一个channels_last布局的 (1,3,H,W) float32 张量，用作模型输入缓冲区"""
+    return torch.empty((1, 3, *input_size), dtype=torch.float32, memory_format=torch.channels_last)
+
+
+def preprocess(image, out):
+    """将uint8图像缩放并归一化，结果原地写入预分配的out张量
+
+    out的内存布局（channels_last）保持不变，与模型的内存布局一致。
+    归一化由numba内核一次完成，不再产生中间的float张量。
+    前端已缩放到模型输入尺寸的帧跳过缩放，numba内核可直接读取任意步长的视图。
+    """
+    image = resize_frame(image)
+    normalize_into(image.numpy(), out[0].numpy(), norm_scale, norm_shift)
+    return out
+
+
+def copy_raw_frame(img_data, rgb_frame):
+    """将原始RGB像素拷贝到连接级复用的rgb_frame中，返回其CHW视图"""
+    np.copyto(rgb_frame.numpy(), np.frombuffer(img_data, dtype=np.uint8).reshape(rgb_frame.shape))
+    # HWC内存上的CHW视图，即channels_last布局，与模型输入布局一致
+    return rgb_frame.permute(2, 0, 1)
+
+
+def decode_frame(img_data, scratch, rgb_frame):
+    """将前端发送的图像数据转换为uint8 RGB CHW张量
+
+    支持两种格式：
+    1. 原始RGB像素：长度恰好为H*W*3字节（模型输入尺寸，行优先，RGBRGB...），
+       直接拷贝到连接级复用的rgb_frame中，返回其CHW视图，无需解码和缩放
+    2. JPEG/PNG：decode_image会根据文件头自动选择libjpeg-turbo或libpng解码，
+       结果直接写入连续的张量，省去PIL图像对象和numpy的中间拷贝
+
+    长度恰好等于原始帧大小的JPEG/PNG也可能出现，因此以完整的文件签名区分两者；
+    首个像素恰好与签名开头相同的原始帧解码失败后仍回退为原始像素。
+
+    Args:
+        img_data: 图像的二进制数据（bytes或bytearray）
+        scratch: 连接级复用的bytearray缓冲区
+        rgb_frame: 连接级复用的 (H,W,3) uint8 张量，用于接收原始RGB像素
+
+    Raises:
+        ValueError: 数据既不是可解码的图像，长度也与原始帧不符
+    """
+    is_raw_size = len(img_data) == rgb_frame.numel()
+    is_encoded = img_data[:3] == b"\xff\xd8\xff" or img_data[:8] == b"\x89PNG\r\n\x1a\n"
+    if is_raw_size and not is_encoded:
+        return copy_raw_frame(img_data, rgb_frame)
+
+    # torch.frombuffer需要可写缓冲区，bytearray可直接使用，无需再拷贝
+    if isinstance(img_data, bytearray):
+        buf = torch.frombuffer(img_data, dtype=torch.uint8)
+    else:
+        # 只读的bytes拷贝到复用的缓冲区中，避免每帧分配新的bytearray
+        n = len(img_data)
+        if n > len(scratch):
+            scratch.extend(bytes(n - len(scratch)))
+        scratch[:n] = img_data
+        buf = torch.frombuffer(scratch, dtype=torch.uint8, count=n)
+    try:
+        return decode_image(buf, mode=ImageReadMode.RGB)
+    except (RuntimeError, ValueError) as e:
+        if is_raw_size:
+            return copy_raw_frame(img_data, rgb_frame)
+        height, width, _ = rgb_frame.shape
+        raise ValueError(
+            f"expected a JPEG/PNG image or a raw {height}x{width} RGB frame "
+            f"({rgb_frame.numel()} bytes), got {len(img_data)} bytes; "
+            f"check that the frontend FRAME_SIZE matches the model input size"
+        ) from e
+
+
+def resize_frame(image):
+    """将uint8 CHW图像缩放到模型输入尺寸，已是该尺寸的帧（前端预缩放）原样返回"""
+    if tuple(image.shape[-2:]) != input_size:
+        image = transform(image)
+    return image
+
+
+@numba.njit(fastmath=True, cache=True)
+def frame_key(src):
+    """计算图像的64位平均哈希（aHash），用作推理结果缓存的键
+
+    将已缩放到模型输入尺寸的uint8 CHW图像按8x8网格求灰度块和，
+    块和大于所有块均值的位置为1。直接读取uint8像素，不产生float拷贝。
+    """
+    channels, height, width = src.shape
+    bh = height // 8
+    bw = width // 8
+    cells = np.zeros(64, dtype=np.float32)
+    for y in range(bh * 8):
+        row = (y // bh) * 8
+        for x in range(bw * 8):
+            acc = 0.0
+            for c in range(channels):
+                acc += src[c, y, x]
+            cells[row + x // bw] += acc
+    mean = cells.mean()
+    key = np.uint64(0)
+    for i in range(64):
+        if cells[i] > mean:
+            key |= np.uint64(1) << np.uint64(i)
+    return key
+
+
+def cache_lookup(cache, key):
+    """在结果缓存中查找与key相同或汉明距离不超过HASH_MAX_DISTANCE的条目
+
+    先做精确查找；未命中时从最近使用的条目开始线性扫描，同一人脸的相邻帧
+    通常位于末尾，很快即可命中。命中的条目移动到LRU末尾；
+    已连续命中CACHE_MAX_HITS次的条目被移除，返回None以强制重新推理。
+
+    Args:
+        cache: 连接级结果缓存，值为 [pred, conf, 命中次数]
+        key: frame_key计算的64位哈希
+    """
+    entry = cache.get(key)
+    if entry is None:
+        for k in reversed(cache):
+            if bin(k ^ key).count("1") <= HASH_MAX_DISTANCE:
+                key = k
+                entry = cache[k]
+                break
+        else:
+            return None
+    if entry[2] >= CACHE_MAX_HITS:
+        del cache[key]
+        return None
+    entry[2] += 1
+    cache.move_to_end(key)
+    return entry[0], entry[1]
+
+
+def cache_store(cache, key, pred, conf):
+    """写入结果缓存，超出容量时淘汰最久未使用的条目"""
+    cache[key] = [pred, conf, 0]
+    if len(cache) > RESULT_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def parse_vit_depth(value):
+    """解析EMOTION_VIT_DEPTH的取值，未设置时返回None（不剪枝）
+
+    Raises:
+        ValueError: 取值不是大于等于1的整数
+    """
+    if not value:
+        return None
+    try:
+        depth = int(value)
+    except ValueError:
+        raise ValueError(f"EMOTION_VIT_DEPTH must be a positive integer, got {value!r}") from None
+    if depth < 1:
+        raise ValueError(f"EMOTION_VIT_DEPTH must be at least 1, got {depth}")
+    return depth
+
+
+def onnx_cache_path(depth):
+    """ONNX模型缓存路径，不存在时在启动时导出
+
+    剪枝深度不同的模型使用不同的缓存文件；路径中还包含模型目录下文件的最新修改时间，
+    检查点更新后会自动重新导出，不会误用过期的缓存。
+    """
+    suffix = f"-depth{depth}" if depth else ""
+    if os.path.isdir(MODEL_DIR):
+        mtime = max((os.path.getmtime(os.path.join(MODEL_DIR, name)) for name in os.listdir(MODEL_DIR)), default=0)
+        suffix += f"-{int(mtime)}"
+    return MODEL_DIR.rstrip("/") + suffix + ".onnx"
+
+
+def remove_stale_onnx(onnx_path):
+    """删除同一剪枝深度下、由旧版本检查点导出的ONNX缓存文件
+
+    缓存文件名形如 <模型目录>[-depthN]-<mtime>.onnx，只删除前缀相同、
+    末段为其他mtime的文件。
+    """
+    prefix, _, stamp = onnx_path[:-len(".onnx")].rpartition("-")
+    if not stamp.isdigit():
+        return
+    for path in glob.glob(glob.escape(prefix) + "-*.onnx"):
+        if path != onnx_path and path[len(prefix) + 1:-len(".onnx")].isdigit():
+            print(f"🗑️ Removing stale ONNX export {path}")
+            os.remove(path)
+
+
+def prune_encoder_layers(hf_model, depth):
+    """对ViT进行深度方向的结构化剪枝，只保留前depth个Transformer编码层
+
+    7类表情分类任务下模型参数冗余较大，去掉靠后的若干编码层可成比例地减少
+    计算量和权重读取量。直接剪枝会损失一定精度，建议离线剪枝后在验证集上
+    重新校准分类头并保存，再通过EMOTION_MODEL_DIR加载剪枝后的模型。
+    """
+    layers = hf_model.vit.encoder.layer
+    if depth >= len(layers):
+        return hf_model
+    hf_model.vit.encoder.layer = nn.ModuleList(layers[:depth])
+    hf_model.config.num_hidden_layers = depth
+    return hf_model
+
+
+def quantize_model(hf_model):
+    """对模型中的Linear层进行动态INT8量化
+
+    ViT的计算主要集中在Linear层的矩阵乘法上，动态量化将其权重转换为int8，
+    并在x86上使用FBGEMM、在ARM上使用QNNPACK的int8 GEMM内核。
+    LayerNorm、注意力中的softmax等非Linear算子保持FP32不变。
+    """
+    machine = platform.machine().lower()
+    torch.backends.quantized.engine = "qnnpack" if machine in ("arm64", "aarch64") else "fbgemm"
+    return torch.quantization.quantize_dynamic(hf_model, {nn.Linear}, dtype=torch.qint8)
+
+
+def build_scripted_model(hf_model, example):
+    """将HF模型追踪为TorchScript并冻结
+
+    冻结后权重被内联为常量，图中的算子得以融合，推理时不再有Python层的
+    属性查找和transformers的调度开销。
+    """
+    # 启用oneDNN图融合，冻结后的IR可由oneDNN选择分块布局并融合算子
+    torch.jit.enable_onednn_fusion(True)
+    with torch.no_grad():
+        # HF模型的输出包含非张量结构，使用strict=False放宽追踪限制
+        traced = torch.jit.trace(ViTClassifier(hf_model).eval(), example, strict=False)
+    return torch.jit.freeze(traced)
+
+
+class OnnxClassifier:
+    """ONNX Runtime推理会话的包装，调用方式与TorchScript模块保持一致
+
+    输入为pixel_values张量，输出为logits张量，便于批处理任务无差别调用。
+    """
+
+    def __init__(self, sess):
+        self.sess = sess
+
+    def __call__(self, pixel_values):
+        # ONNX Runtime要求输入为NCHW连续内存
+        logits = self.sess.run(None, {"pixel_values": pixel_values.contiguous().numpy()})[0]
+        return torch.from_numpy(logits)
+
+
+def build_onnx_model(hf_model, example, onnx_path):
+    """将HF模型导出为ONNX并创建ONNX Runtime推理会话
+
+    ONNX Runtime的CPU执行器会对ViT做注意力、GELU、LayerNorm等图融合。
+    导出结果缓存在onnx_path，仅在文件不存在时导出。批次维度保持动态以支持微批处理。
+    """
+    # onnxruntime为可选依赖，仅在选择该后端时导入
+    import onnxruntime as ort
+
+    def export():
+        print(f"📦 Exporting ONNX model to {onnx_path}...")
+        with torch.no_grad():
+            torch.onnx.export(
+                ViTClassifier(hf_model).eval(),
+                (example,),
+                onnx_path,
+                opset_version=17,
+                input_names=["pixel_values"],
+                output_names=["logits"],
+                dynamic_axes={"pixel_values": {0: "B"}, "logits": {0: "B"}},
+            )
+
+    def create_session():
+        so = ort.SessionOptions()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        so.intra_op_num_threads = torch.get_num_threads()
+        # CUDA执行器可用时优先使用GPU，否则回退到CPU
+        providers = [p for p in ("CUDAExecutionProvider", "CPUExecutionProvider")
+                     if p in ort.get_available_providers()]
+        return ort.InferenceSession(onnx_path, sess_options=so, providers=providers)
+
+    if not os.path.exists(onnx_path):
+        export()
+        remove_stale_onnx(onnx_path)
+    return OnnxClassifier(create_session())
+
+
+def build_compiled_model(hf_model):
+    """使用torch.compile（Inductor）编译模型，作为TorchScript之外的另一种选择
+
+    Inductor对LayerNorm、Linear、GELU等做图级融合并生成C++/Triton内核，
+    reduce-overhead模式在GPU上还会使用CUDA Graph消除批次为1时的内核启动开销。
+    输入的H/W固定，dynamic=False使每个批次分桶都得到专门的编译结果。
+    """
+    return torch.compile(ViTClassifier(hf_model).eval(), mode="reduce-overhead", fullgraph=False, dynamic=False)
+
+
+def padded_batch_size(n):
+    """返回n帧实际送入模型的批次大小：Inductor后端补齐到分桶大小，其他后端不补齐"""
+    if INFER_BACKEND != "inductor":
+        return n
+    return next(size for size in COMPILE_BATCH_SIZES if size >= n)
+
+
+def run_inference(batch):
+    """在推理线程中执行一次前向传播，返回logits
+
+    inference_mode是线程局部的，必须在执行推理的线程内进入。
+    """
+    # inference_mode同时禁用自动求导和张量的版本计数/视图追踪
+    with torch.inference_mode():
+        if device.type == "cuda":
+            # 从锁页内存异步拷贝到显存，并转换为与模型权重一致的FP16
+            batch = batch.to(device, non_blocking=True).half()
+            return model(batch).float().cpu()
+        return model(batch)
+
+
+async def batch_worker():
+    """后台微批处理任务
+
+    从待推理队列中取出各连接提交的帧，拼接为一个批次进行一次前向传播，
+    再将每一行结果分别写回对应的future。批次越大，矩阵乘法的计算密度越高，
+    均摊到每一帧的推理开销越低。
+    前向传播交给单个专用推理线程执行，事件循环在此期间继续接收各连接的帧，
+    这些帧会在推理线程下一次空闲时组成新的批次。
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        # 阻塞等待第一帧，队列为空时不空转
+        items = [await pending.get()]
+        # 留出一个很短的窗口，让其他客户端的帧有机会进入同一批次
+        await asyncio.sleep(BATCH_WINDOW)
+        while len(items) < MAX_BATCH_SIZE and not pending.empty():
+            items.append(pending.get_nowait())
+
+        try:
+            tensors = [pixel_values for pixel_values, _ in items]
+            n = len(tensors)
+            size = padded_batch_size(n)
+            if batch_buffer is not None:
+                # 直接拼接到锁页内存中；上一批次的结果已拷回CPU，缓冲区可以安全复用
+                batch = batch_buffer[:size]
+            else:
+                batch = torch.empty((size, 3, *input_size), dtype=torch.float32, memory_format=torch.channels_last)
+            torch.cat(tensors, out=batch[:n])
+            # 补齐的行填零，其推理结果在下方按帧数截断后丢弃
+            batch[n:].zero_()
+            logits = await loop.run_in_executor(infer_executor, run_inference, batch)
+        except Exception as e:
+            print("❌ Batch inference failed:", e)
+            # 将异常传递给所有等待中的连接，由各连接自行处理
+            for _, fut in items:
+                if not fut.done():
+                    fut.set_exception(e)
+            continue
+
+        # 连接在等待期间断开时future会被取消，此时跳过即可
+        for (_, fut), row in zip(items, logits):
+            if not fut.done():
+                fut.set_result(row)
+
 
 @app.on_event("startup")
 async def startup_event():
@@ -44,15 +549,91 @@ async def startup_event():
     在FastAPI应用启动时自动执行，负责加载预训练模型并初始化必要的组件。
     使用异步方式确保不会阻塞应用启动流程，同时提供详细的日志输出。
     """
-    global extractor, model, id2label
+    global extractor, model, id2label, payload_prefixes, transform, input_size, norm_scale, norm_shift
+    global pending, batch_task, infer_executor, batch_buffer, device
     try:
-        print("🔄 Loading model from ./vit-face-expression...")
-        # 从本地预训练模型文件夹加载特征提取器
-        extractor = AutoFeatureExtractor.from_pretrained("./vit-face-expression")
+        # 先校验配置，避免在加载模型之后才发现取值非法
+        vit_depth = parse_vit_depth(VIT_DEPTH)
+        # 线程配置必须在任何并行计算开始之前完成
+        configure_torch()
+        print(f"🔄 Loading model from {MODEL_DIR}...")
+        # 从本地预训练模型文件夹加载图像处理器（使用基于torch算子的快速实现）
+        extractor = AutoImageProcessor.from_pretrained(MODEL_DIR, use_fast=True)
         # 加载分类模型并设置为评估模式（禁用dropout等训练时特有的层）
-        model = AutoModelForImageClassification.from_pretrained("./vit-face-expression").eval()
+        model = AutoModelForImageClassification.from_pretrained(MODEL_DIR).eval()
         # 获取标签映射表，用于将预测索引转换为情感类别标签
-        id2label = model.config.id2label
+        # 需在量化和追踪之前从原始config中取出，追踪后的模块不再携带config
+        # 转换为按索引排列的元组，每帧按整数下标取值，无需字典哈希查找
+        id2label = tuple(model.config.id2label[i] for i in range(len(model.config.id2label)))
+        # 每个标签对应的结果JSON只有置信度会变化，预先序列化其余部分
+        payload_prefixes = tuple(
+            orjson.dumps({"emotion": label})[:-1].decode() + ',"confidence":' for label in id2label
+        )
+        # 按配置裁剪编码层
+        if vit_depth:
+            print(f"✂️ Pruning ViT encoder to {vit_depth} layers...")
+            model = prune_encoder_layers(model, vit_depth)
+        # 根据特征提取器的配置构建预处理流水线
+        transform = build_transform(extractor)
+        input_size = get_input_size(extractor)
+        norm_scale, norm_shift = build_normalization(extractor)
+        # 使用一张空白图像作为示例输入，用于模型追踪或导出
+        blank = torch.zeros((3, *input_size), dtype=torch.uint8)
+        example = preprocess(blank, alloc_pixel_values())
+        # numba内核按数组内存布局分别编译：解码缩放后的帧是连续的CHW，
+        # 前端原始RGB帧是HWC内存上的CHW视图。启动时两种布局各调用一次，
+        # 避免首帧在事件循环上触发编译
+        raw_view = torch.zeros((*input_size, 3), dtype=torch.uint8).permute(2, 0, 1)
+        preprocess(raw_view, alloc_pixel_values())
+        frame_key(blank.numpy())
+        frame_key(raw_view.numpy())
+
+        if INFER_BACKEND == "onnx":
+            print("🔧 Building ONNX Runtime session...")
+            model = build_onnx_model(model, example, onnx_cache_path(vit_depth))
+        else:
+            if torch.cuda.is_available():
+                # GPU上使用FP16权重，利用Tensor Core加速矩阵乘法，同时减半权重读取量
+                print("🚀 Moving model to CUDA with FP16 weights...")
+                device = torch.device("cuda")
+                model = model.half().to(device, memory_format=torch.channels_last)
+                example = example.to(device).half()
+                # 预分配锁页内存批次缓冲区，主机到显存的拷贝可以异步进行
+                # 一次分配完成，避免后续的布局转换把数据拷贝回普通的可分页内存
+                batch_buffer = torch.empty(
+                    (MAX_BATCH_SIZE, 3, *input_size), dtype=torch.float32,
+                    memory_format=torch.channels_last, pin_memory=True,
+                )
+            else:
+                if INFER_BACKEND != "inductor":
+                    # 对Linear层进行动态INT8量化，降低推理延迟（仅适用于CPU）
+                    # Inductor后端自行融合FP32算子，不做量化
+                    print("🔧 Quantizing Linear layers to INT8...")
+                    model = quantize_model(model)
+                # 使用channels_last内存布局，便于oneDNN/MKLDNN为patch embedding卷积选择更优的分块方式
+                model = model.to(memory_format=torch.channels_last)
+
+            if INFER_BACKEND == "inductor":
+                print("🔧 Compiling model with torch.compile (Inductor)...")
+                model = build_compiled_model(model)
+            else:
+                # 将模型追踪为TorchScript，之后每一帧的推理都直接调用追踪后的模块
+                print("🔧 Tracing model with TorchScript...")
+                model = build_scripted_model(model, example)
+        # 启动专用推理线程和后台微批处理任务
+        infer_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        if INFER_BACKEND == "inductor":
+            # 在推理线程中为每个批次分桶预热，使全部编译开销发生在接受连接之前，
+            # 同时保证CUDA Graph在实际执行推理的线程中捕获。
+            # reduce-overhead模式下首次调用只完成编译，CUDA Graph在之后的调用中才录制，
+            # 因此每个分桶执行三次
+            for size in COMPILE_BATCH_SIZES:
+                print(f"🔥 Warming up compiled model (batch size {size})...")
+                warmup = torch.zeros((size, 3, *input_size), dtype=torch.float32, memory_format=torch.channels_last)
+                for _ in range(3):
+                    await asyncio.get_running_loop().run_in_executor(infer_executor, run_inference, warmup)
+        pending = asyncio.Queue()
+        batch_task = asyncio.create_task(batch_worker())
         print("✅ Model loaded successfully")
     except Exception as e:
         print(f"❌ Error loading model: {str(e)}")
@@ -77,7 +658,7 @@ async def websocket_endpoint(websocket: WebSocket):
     """
     # 检查模型组件是否已正确初始化
     # 如果模型未初始化，拒绝连接并记录错误
-    if not all([extractor, model, id2label]):
+    if not all([extractor, model, id2label, transform]):
         print("❌ Model not initialized")
         return
 
@@ -85,71 +666,114 @@ async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     # 记录连接信息，便于调试和监控
     print(f"✅ WebSocket connected from {websocket.client.host}:{websocket.client.port}")
+
+    # 连接级复用的缓冲区，避免每帧重新分配内存
+    # 同一连接在取回推理结果后才会处理下一帧，因此复用是安全的
+    scratch = bytearray(1 << 20)            # 图像二进制数据缓冲区
+    rgb_frame = torch.empty((*input_size, 3), dtype=torch.uint8)  # 原始RGB像素帧
+    pixel_values = alloc_pixel_values()     # 模型输入张量
+    # 结果缓存按连接隔离，避免不同客户端的相似画面共用推理结果
+    result_cache = OrderedDict() if RESULT_CACHE_ENABLED else None
+
+    # 将循环中频繁访问的全局对象和方法绑定为局部变量
+    # 循环内的访问由LOAD_GLOBAL/LOAD_ATTR变为LOAD_FAST
+    loop = asyncio.get_running_loop()
+    receive = websocket.receive
+    send_text = websocket.send_text
+    dumps = orjson.dumps
+    loads = orjson.loads
+    b64decode = pybase64.b64decode_as_bytearray
+    labels = id2label
+    prefixes = payload_prefixes
+    queue = pending
+
+    async def send_json(obj):
+        # 使用orjson序列化，仍以文本帧发送，前端按JSON文本解析的方式不变
+        await send_text(dumps(obj).decode())
     
     # 持续监听并处理前端消息
     while True:
         try:
-            # 接收前端发送的人脸ROI（Base64编码的图像数据）
+            # 接收前端发送的人脸ROI
+            # 优先使用二进制帧（模型输入尺寸的原始RGB像素或JPEG/PNG字节），
+            # 同时兼容Base64编码的JSON文本帧
             print("👂 Waiting for data from frontend...")
-            data = await websocket.receive_text()
+            message = await receive()
+            # receive()在断开时不会像receive_text()那样抛出异常，需要手动检查
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
             print("... Received data.")
+            img_data = message.get("bytes")
 
-            # 数据验证和错误处理 - JSON解析
-            try:
-                obj = json.loads(data)
-                img_b64 = obj.get("image")
-                # 检查必要的字段是否存在
-                if not img_b64:
-                    print("⚠️ Missing 'image' field in JSON payload.")
+            if img_data is None:
+                # 数据验证和错误处理 - JSON解析
+                try:
+                    obj = loads(message.get("text") or "")
+                    img_b64 = obj.get("image")
+                    # 检查必要的字段是否存在
+                    if not img_b64:
+                        print("⚠️ Missing 'image' field in JSON payload.")
+                        # 向客户端发送错误信息
+                        await send_json({"error": "missing image field"})
+                        # 跳过当前循环，等待下一条有效消息
+                        continue
+                except orjson.JSONDecodeError:
+                    print("⚠️ Invalid JSON received.")
                     # 向客户端发送错误信息
-                    await websocket.send_json({"error": "missing image field"})
-                    # 跳过当前循环，等待下一条有效消息
+                    await send_json({"error": "invalid json"})
                     continue
-            except json.JSONDecodeError:
-                print("⚠️ Invalid JSON received.")
-                # 向客户端发送错误信息
-                await websocket.send_json({"error": "invalid json"})
-                continue
 
             # 图像解码和预处理
             try:
-                print("🖼️ Decoding base64 image...")
-                # 将Base64编码的字符串解码为二进制数据
-                img_data = base64.b64decode(img_b64)
-                # 将二进制数据转换为PIL图像对象，并确保为RGB格式
-                image = Image.open(io.BytesIO(img_data)).convert("RGB")
+                if img_data is None:
+                    print("🖼️ Decoding base64 image...")
+                    # 将Base64编码的字符串解码为二进制数据
+                    # pybase64使用SIMD指令解码，并直接返回可写的bytearray
+                    img_data = b64decode(img_b64, validate=False)
+                # 将二进制数据直接解码为RGB格式的uint8张量
+                image = decode_frame(img_data, scratch, rgb_frame)
                 print("... Image decoded successfully.")
             except Exception as decode_err:
                 # 向客户端发送错误信息
-                await websocket.send_json({"error": "invalid image data"})
+                await send_json({"error": "invalid image data"})
                 print("⚠️ invalid image data:", decode_err)
                 continue
 
-            # 模型推理过程
-            print("🧠 Performing model inference...")
-            # 使用特征提取器处理图像，准备模型输入
-            inputs = extractor(images=image, return_tensors="pt")
-            # 禁用梯度计算，提高推理速度并减少内存使用
-            with torch.no_grad():
-                # 前向传播获取模型输出的原始分数
-                logits = model(**inputs).logits
-                # 应用softmax函数获取概率分布
-                probs = torch.nn.functional.softmax(logits, dim=-1)[0]
-            # 获取最高概率对应的类别索引
-            pred = int(probs.argmax())
+            # 先缩放到模型输入尺寸，启用缓存时再查询结果缓存，相同的人脸画面无需重复推理
+            image = resize_frame(image)
+            cached = None
+            if result_cache is not None:
+                key = int(frame_key(image.numpy()))
+                cached = cache_lookup(result_cache, key)
+            if cached is not None:
+                print("⚡ Cache hit, skipping model inference.")
+                pred, conf = cached
+            else:
+                # 模型推理过程
+                print("🧠 Performing model inference...")
+                # 使用预先构建的预处理流水线处理图像，原地写入预分配的模型输入张量
+                preprocess(image, pixel_values)
+                # 提交到微批处理队列，与其他连接的帧合并推理后取回本帧的logits
+                fut = loop.create_future()
+                await queue.put((pixel_values, fut))
+                logits = await fut
+                # softmax单调，logits最大值对应的类别即为最高概率的类别
+                pred = int(logits.argmax())
+                # 只计算预测类别的softmax概率作为置信度：exp(m) / Σexp(x) = 1 / Σexp(x - m)
+                conf = 1.0 / float(torch.exp(logits - logits[pred]).sum())
+                # 写入缓存，超出容量时淘汰最久未使用的条目
+                if result_cache is not None:
+                    cache_store(result_cache, key, pred, conf)
             # 获取对应的情感标签
-            label = id2label[pred]
-            # 获取预测的置信度
-            conf = float(probs[pred])
+            label = labels[pred]
             # 记录推理结果
             print(f"... Inference complete. Detected: {label} (Confidence: {conf:.2f})")
 
             # 发送结果
             print("📤 Sending results to frontend...")
-            await websocket.send_json({
-                "emotion": label,    # 识别出的情感类别
-                "confidence": conf   # 预测置信度
-            })
+            # 结果格式为 {"emotion": 情感类别, "confidence": 预测置信度}，
+            # 只需在预先序列化的前缀后拼接置信度
+            await send_text(prefixes[pred] + dumps(conf).decode() + "}")
             print("... Results sent.")
         except WebSocketDisconnect as e:
             # 客户端主动断开连接的情况
@@ -9,7 +9,7 @@
 """
 
 import torch
-from transformers import AutoFeatureExtractor, AutoModelForImageClassification
+from transformers import AutoImageProcessor, AutoModelForImageClassification
 import numpy as np
 from PIL import Image
 
@@ -32,8 +32,8 @@ class EmotionModel:
         # 设置计算设备（优先使用GPU，否则使用CPU）
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         
-        # 加载特征提取器，用于图像预处理
-        self.extractor = AutoFeatureExtractor.from_pretrained(model_name)
+        # 加载图像处理器，用于图像预处理（使用基于torch算子的快速实现）
+        self.extractor = AutoImageProcessor.from_pretrained(model_name, use_fast=True)
         
         # 加载预训练模型并移至指定设备
         self.model = AutoModelForImageClassification.from_pretrained(model_name).to(self.device)
@@ -59,24 +59,21 @@ class EmotionModel:
         # 使用特征提取器预处理图像并转换为PyTorch张量
         inputs = self.extractor(images=pil_face, return_tensors="pt").to(self.device)
         
-        # 进行推理，禁用梯度计算以提高性能
-        with torch.no_grad():
+        # 进行推理，禁用梯度计算及张量的版本计数/视图追踪以提高性能
+        with torch.inference_mode():
             # 前向传播获取模型输出
             outputs = self.model(**inputs)
             
             # 获取原始预测分数
-            logits = outputs.logits
-            
-            # 应用softmax函数转换为概率分布
-            probs = torch.nn.functional.softmax(logits, dim=-1)[0]
+            logits = outputs.logits[0]
         
-        # 获取最高概率的类别ID
-        pred_id = int(torch.argmax(probs))
+        # 获取最高概率的类别ID（softmax单调，直接在logits上取argmax即可）
+        pred_id = int(torch.argmax(logits))
         
         # 将类别ID转换为可读标签
         label = self.id2label[pred_id]
         
-        # 获取对应类别的置信度并转换为NumPy浮点数
-        conf = float(probs[pred_id].cpu().numpy())
+        # 只计算预测类别的softmax概率作为置信度：exp(m) / Σexp(x) = 1 / Σexp(x - m)
+        conf = 1.0 / float(torch.exp(logits - logits[pred_id]).sum())
         
         return label, conf
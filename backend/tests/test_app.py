@@ -0,0 +1,30 @@
+"""服务端冒烟测试：启动应用并通过WebSocket发送一帧"""
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+pytest.importorskip("numba")
+pytest.importorskip("transformers")
+pytest.importorskip("httpx")
+testclient = pytest.importorskip("fastapi.testclient")
+
+import app
+
+
+@pytest.mark.skipif(
+    not os.path.isfile(os.path.join(app.MODEL_DIR, "config.json")),
+    reason=f"model checkpoint not found in {app.MODEL_DIR}",
+)
+def test_websocket_binary_frame():
+    # 进入上下文时触发startup_event，完成模型加载和后端构建
+    with testclient.TestClient(app.app) as client:
+        height, width = app.input_size
+        with client.websocket_connect("/ws/emotion") as ws:
+            ws.send_bytes(bytes(height * width * 3))
+            result = ws.receive_json()
+
+    assert result["emotion"] in app.id2label
+    assert 0.0 < result["confidence"] <= 1.0
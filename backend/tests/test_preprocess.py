@@ -0,0 +1,80 @@
+"""预处理流水线与HF图像处理器的一致性测试"""
+import io
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+pytest.importorskip("numba")
+transformers = pytest.importorskip("transformers")
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("fastapi")
+
+import app
+
+
+@pytest.fixture
+def extractor(monkeypatch):
+    """使用ViT默认配置（224x224，mean=std=0.5）初始化app的预处理全局变量"""
+    extractor = transformers.ViTImageProcessor()
+    scale, shift = app.build_normalization(extractor)
+    monkeypatch.setattr(app, "transform", app.build_transform(extractor))
+    monkeypatch.setattr(app, "input_size", app.get_input_size(extractor))
+    monkeypatch.setattr(app, "norm_scale", scale)
+    monkeypatch.setattr(app, "norm_shift", shift)
+    return extractor
+
+
+def smooth_image(height, width, seed=0):
+    """生成平滑的随机RGB图像，避免JPEG压缩和缩放插值在高频处的差异主导误差"""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+    return np.asarray(Image.fromarray(coarse).resize((width, height), Image.BICUBIC))
+
+
+def run_pipeline(img_data):
+    """按websocket_endpoint的方式解码并预处理一帧，返回 (1,3,H,W) 模型输入"""
+    rgb_frame = torch.empty((*app.input_size, 3), dtype=torch.uint8)
+    image = app.decode_frame(img_data, bytearray(1 << 20), rgb_frame)
+    return image, app.preprocess(image, app.alloc_pixel_values())
+
+
+def reference(extractor, image):
+    """HF处理器对uint8 CHW图像的输出"""
+    hwc = image.permute(1, 2, 0).contiguous().numpy()
+    return extractor(images=hwc, return_tensors="pt")["pixel_values"]
+
+
+def test_raw_frame_matches_processor(extractor):
+    frame = smooth_image(*app.input_size)
+    image, pixel_values = run_pipeline(frame.tobytes())
+
+    assert pixel_values.is_contiguous(memory_format=torch.channels_last)
+    torch.testing.assert_close(pixel_values, reference(extractor, image), atol=1e-5, rtol=0)
+
+
+def test_jpeg_frame_matches_processor(extractor):
+    buf = io.BytesIO()
+    Image.fromarray(smooth_image(320, 320, seed=1)).save(buf, format="JPEG", quality=95)
+    image, pixel_values = run_pipeline(buf.getvalue())
+
+    assert tuple(image.shape) == (3, 320, 320)
+    # torchvision与PIL的双线性缩放实现不同，允许约几个灰度级的误差（1级约为0.008）
+    expected = reference(extractor, image)
+    assert (pixel_values - expected).abs().max() < 0.05
+    assert (pixel_values - expected).abs().mean() < 0.01
+
+
+def test_raw_frame_with_signature_prefix(extractor):
+    # 首个像素为(255, 216, 255)的原始帧与JPEG文件头相同，解码失败后应回退为原始像素
+    frame = smooth_image(*app.input_size, seed=2)
+    frame[0, 0] = (0xFF, 0xD8, 0xFF)
+    image, _ = run_pipeline(frame.tobytes())
+
+    assert torch.equal(image.permute(1, 2, 0), torch.from_numpy(frame))
+
+
+def test_size_mismatch_is_reported(extractor):
+    with pytest.raises(ValueError, match="FRAME_SIZE"):
+        run_pipeline(bytes(100 * 100 * 3))
@@ -14,6 +14,15 @@ let lastSendTime = 0;
 const sendInterval = 200; // 200 ms -> ~5 FPS
 let lastEmotion = '';
 
+// 发送给后端的帧格式：模型输入尺寸的RGB uint8像素，按行优先排列（224*224*3 = 150528字节）
+// 人脸ROI在前端缩放到该尺寸，后端无需再做解码和缩放
+const FRAME_SIZE = 224;
+const frameCanvas = document.createElement('canvas');
+frameCanvas.width = FRAME_SIZE;
+frameCanvas.height = FRAME_SIZE;
+const frameCtx = frameCanvas.getContext('2d', { willReadFrequently: true });
+const frameRGB = new Uint8Array(FRAME_SIZE * FRAME_SIZE * 3);
+
 function connectWebSocket() {
   if (socket && (socket.readyState === WebSocket.CONNECTING || socket.readyState === WebSocket.OPEN)) {
     return; // Already connecting or connected
@@ -160,24 +169,24 @@ function setupFaceDetectionCallback() {
     if (w <= 0 || h <= 0) return;
 
     try {
-      // 截取人脸 ROI — getImageData requires integer 'long' parameters
-      const face = ctx.getImageData(x, y, w, h);
-      const tmpCanvas = document.createElement('canvas');
-      tmpCanvas.width = w;
-      tmpCanvas.height = h;
-      tmpCanvas.getContext('2d').putImageData(face, 0, 0);
-      const base64 = tmpCanvas.toDataURL('image/jpeg').split(',')[1];
-
-      console.log("Sending face data to backend...");
-
       // 发送给后端 (限速，避免过多并发消息导致连接不稳定)
       if (socket && socket.readyState === WebSocket.OPEN) {
         const now = Date.now();
         // lastSendTime & sendInterval are defined at module scope
         if ((now - lastSendTime) >= sendInterval) {
+          // 截取人脸 ROI 并直接缩放到模型输入尺寸
+          frameCtx.drawImage(canvas, x, y, w, h, 0, 0, FRAME_SIZE, FRAME_SIZE);
+          const rgba = frameCtx.getImageData(0, 0, FRAME_SIZE, FRAME_SIZE).data;
+          // RGBA -> RGB，丢弃alpha通道
+          for (let i = 0, j = 0; i < rgba.length; i += 4, j += 3) {
+            frameRGB[j] = rgba[i];
+            frameRGB[j + 1] = rgba[i + 1];
+            frameRGB[j + 2] = rgba[i + 2];
+          }
           try {
             console.log("Sending face data to backend...");
-            socket.send(JSON.stringify({ image: base64 }));
+            // 以二进制帧直接发送像素数据，省去JPEG编解码、Base64编码和JSON封装
+            socket.send(frameRGB);
             lastSendTime = now;
           } catch (err) {
             console.warn('Error sending frame:', err);